@@ -0,0 +1,485 @@
+"""Pipeline común de descarga Sentilo → JSONs del dashboard.
+
+Los scripts descarga_header.py / descarga_multisensor2.py son el mismo flujo
+con distinta configuración (lista blanca, límites, tokens). Aquí vive el
+pipeline una sola vez, parametrizado con un Perfil; cada script define su
+perfil y llama a run(). El Excel se parsea una única vez por proceso aunque
+se ejecuten varios perfiles seguidos.
+"""
+
+import os
+import re
+import json
+import asyncio
+import functools
+import aiohttp
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from datetime import datetime
+
+# orjson (Rust) parsea/serializa varias veces más rápido que el json estándar;
+# si no está instalado seguimos funcionando con la stdlib
+try:
+    import orjson
+
+    def json_loads(raw):
+        return orjson.loads(raw)
+
+    def json_dump_bytes(data, compact=False):
+        if compact:
+            return orjson.dumps(data)
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+
+except ImportError:
+    orjson = None
+
+    def json_loads(raw):
+        return json.loads(raw)
+
+    def json_dump_bytes(data, compact=False):
+        if compact:
+            return json.dumps(data, separators=(",", ":"),
+                              ensure_ascii=False).encode("utf-8")
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+# ==================================================
+# CONFIG
+# ==================================================
+SENTILO_URL = "http://connectaapi.bcn.cat/data"
+EXCEL_FILE = "Relación sensores AVINYÓ.xls"
+DATA_FOLDER = "datos_sensores"
+INDEX_JSON = "indice_sensores.json"
+
+DEFAULT_PROVIDER_ID = "SIGE_PR_0190"
+CALC_SENSOR_ID = "0190_MV_ENERGIA_CONS"
+
+# timeout partido (conectar rápido o abortar; leer con margen) y reintentos
+# con backoff para 5xx transitorios: un fallo puntual no mata el sensor
+TIMEOUT_HTTP = aiohttp.ClientTimeout(total=20, connect=5)
+RETRY_STATUS = frozenset({500, 502, 503, 504})
+MAX_INTENTOS = 3
+
+TOKEN_STD = os.getenv("SENTILO_TOKEN", "").strip()
+TOKEN_FV  = os.getenv("SENTILO_TOKEN_FV", "").strip()
+
+# plantillas de cabeceras construidas una vez (no un dict por petición)
+HEADERS_STD = {"IDENTITY_KEY": TOKEN_STD, "Accept": "application/json"}
+HEADERS_FV  = {"IDENTITY_KEY": TOKEN_FV, "Accept": "application/json"}
+
+# columnas del Excel que realmente usamos (el resto ni se parsea)
+EXCEL_COLS = {"sensor_id", "descripcion", "unitat de mesura", "unidad",
+              "tipus de dada", "tipo_dato", "provider_id", "token_env"}
+
+# ==================================================
+# 🔥 SENSORES HEADER (LISTA BLANCA)
+# ==================================================
+HEADER_SENSORS = frozenset({
+
+    # energía base
+    "0190_MV_C1_ASB_ACTIVEE",
+    "0524_MV_FVENERGIA",
+    "0190_MV_CIA_EXPORT",
+    "0190_MV_ENERGIA_CONS",
+
+    # climatización
+    "0190_MV_C2_ASB_ACTIVEE",
+    "0190_MV_C41_CGEM21_EACTIVA",
+
+    # plantas
+    "0190_MV_C10_CGEM21_EACTIVA",
+    "0190_MV_C20_CGEM21_EACTIVA",
+    "0190_MV_C30_CGEM21_EACTIVA",
+    "0190_MV_C40_CGEM21_EACTIVA",
+    "0190_MV_C50_CGEM21_EACTIVA",
+
+    # temperatura / humedad plantas
+    "0190_HV_S1_STPRO_TEMP",
+    "0190_HV_S1_STPRO_HUM",
+    "0190_HV_S2_STPRO_TEMP",
+    "0190_HV_S2_STPRO_HUM",
+    "0190_HV_S3_STPRO_TEMP",
+    "0190_HV_S3_STPRO_HUM",
+    "0190_HV_S4_STPRO_TEMP",
+    "0190_HV_S4_STPRO_HUM",
+    "0190_HV_S5_STPRO_TEMP",
+    "0190_HV_S5_STPRO_HUM",
+
+    # FV ambiente
+    "0524_HV_TEMP_EXT",
+    "0524_HV_IRRAD",
+})
+
+# ==================================================
+# PERFIL
+# ==================================================
+@dataclass(frozen=True)
+class Perfil:
+    """Configuración de una pasada de descarga."""
+    nombre: str
+    whitelist: frozenset = None          # None = todo el catálogo
+    limit_energia: int = 96
+    limit_instant: int = 1
+    max_concurrentes: int = 8            # peticiones simultáneas (no saturar Sentilo)
+    excel: str = EXCEL_FILE
+    index_json: str = INDEX_JSON
+
+
+# ==================================================
+# UTILS
+# ==================================================
+# tabla de plegado a ASCII para los acentos castellano/catalán del catálogo:
+# str.translate corre en C, sin el NFD + filtro por carácter de unicodedata
+_FOLD = str.maketrans("áàäâãéèëêíìïîóòöôõúùüûñç",
+                      "aaaaaeeeeiiiiooooouuuunc")
+
+# el universo de (sensor_id, descripcion) es pequeño y se repite por
+# observación: memoizamos para que cada string se normalice una sola vez
+@functools.lru_cache(maxsize=512)
+def normalizar(txt):
+    return str(txt).lower().strip().translate(_FOLD)
+
+# prefijos/keywords que identifican contadores de energía; el check barato
+# (startswith sobre el id ya normalizado) decide antes de tocar la descripción
+_ENERGY_PREFIXES = ("0190_MV_", "0524_MV_FVENERGIA")
+_ENERGY_KEYWORDS = ("energia", "energy")
+
+@functools.lru_cache(maxsize=512)
+def es_energia(sensor_id, descripcion):
+    sid = str(sensor_id).strip().upper()
+    if sid.startswith(_ENERGY_PREFIXES):
+        return True
+    desc = normalizar(descripcion)
+    return any(k in desc for k in _ENERGY_KEYWORDS)
+
+# fallback para timestamps que el parser C rechaza: reordenar
+# DD/MM/YYYYT... a ISO con una sustitución de regex precompilada
+# (sub-µs por string, sin construir datetime)
+_TS_RE = re.compile(r"(\d{2})/(\d{2})/(\d{4})T(.*)")
+
+def parse_timestamps(ts_raw):
+    """Convierte la lista completa de timestamps Sentilo a ISO de una vez.
+
+    pd.to_datetime con formato fijo usa el parser C (y cache=True dedupe
+    los repetidos); los que no cuadran pasan por el fallback de regex.
+    """
+    ts = pd.to_datetime(ts_raw, format="%d/%m/%YT%H:%M:%S",
+                        errors="coerce", cache=True)
+    iso = ts.strftime("%Y-%m-%dT%H:%M:%S")
+    return [i if isinstance(i, str) else _TS_RE.sub(r"\3-\2-\1T\4", raw)
+            for i, raw in zip(iso, ts_raw)]
+
+# la clasificación energía/instantáneo es invariante por sensor, así que
+# el bucle de observaciones usa un parser ya especializado (sin re-clasificar
+# ni tocar strings en cada punto)
+def _parse_energy(raw):
+    try:
+        s = json_loads(raw).get("summary", {})
+        if "firstvalue" in s and "lastvalue" in s:
+            return float(s["lastvalue"]) - float(s["firstvalue"])
+    except:
+        pass
+    return None
+
+def _parse_avg(raw):
+    try:
+        s = json_loads(raw).get("summary", {})
+        if "avg" in s:
+            return float(s["avg"])
+    except:
+        pass
+    return None
+
+
+# ==================================================
+# CARGA EXCEL (una sola vez por proceso)
+# ==================================================
+@functools.lru_cache(maxsize=4)
+def _cargar_excel(path, mtime):
+    # sidecar .parquet junto al .xls: leerlo es un orden de magnitud más
+    # rápido que re-parsear el Excel y solo se invalida si cambia el mtime
+    sidecar = f"{path}.parquet"
+    try:
+        if os.path.getmtime(sidecar) >= mtime:
+            return pd.read_parquet(sidecar)
+    except Exception:
+        pass  # sidecar inexistente o ilegible: vamos al Excel
+
+    # calamine (Rust) parsea el .xls bastante más rápido que xlrd; si no
+    # está instalado, pandas elige el engine por extensión como siempre
+    try:
+        df = pd.read_excel(path, engine="calamine",
+                           usecols=lambda c: c.strip().lower() in EXCEL_COLS,
+                           dtype=str)
+    except ImportError:
+        df = pd.read_excel(path,
+                           usecols=lambda c: c.strip().lower() in EXCEL_COLS,
+                           dtype=str)
+    df.columns = [c.strip().lower() for c in df.columns]
+
+    try:
+        df.to_parquet(sidecar)
+    except Exception:
+        pass  # sin pyarrow seguimos funcionando, solo sin sidecar
+
+    return df
+
+
+def cargar_excel(path=EXCEL_FILE):
+    # cacheado por (ruta, mtime): varios perfiles en el mismo proceso
+    # reutilizan el mismo parse
+    return _cargar_excel(path, os.path.getmtime(path))
+
+
+# DEBUG_JSON=1 fuerza salida indentada en todos los JSON (inspección a
+# mano); en producción los archivos de sensor van compactos
+DEBUG_JSON = os.getenv("DEBUG_JSON", "") == "1"
+
+
+def atomic_write_json(path, data, compact=False):
+    """Escribe JSON en tmp + os.replace: nunca deja un archivo truncado.
+
+    Si el proceso muere a mitad de escritura, el dashboard sigue viendo
+    la versión anterior completa en lugar de un JSON corrupto.
+    """
+    tmp = f"{path}.tmp"
+    # bytes ya serializados + os.write directo: un solo syscall por payload,
+    # sin TextIOWrapper ni re-encoding por el camino
+    payload = json_dump_bytes(data, compact=compact and not DEBUG_JSON)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
+# ==================================================
+# PIPELINE
+# ==================================================
+def guardar_sensor(indice, sensor_id, descripcion, unidad,
+                   tipo_dato, labels, values):
+    # redondeo a 3 decimales en una pasada NumPy: 0.12345678901234567 no
+    # aporta nada al dashboard y engorda cada JSON (y cada fetch) varias veces
+    values = np.round(np.asarray(values, dtype=np.float64), 3).tolist()
+
+    data = {
+        "sensor_id": sensor_id,
+        "descripcion": descripcion,
+        "unidad": unidad,
+        "tipo_dato": tipo_dato,
+        "labels": labels,
+        "values": values
+    }
+
+    # los JSONs de sensor solo los lee el JS del dashboard: compacto
+    # (indent=2 casi duplicaba bytes en disco y en cada fetch de la página)
+    atomic_write_json(f"{DATA_FOLDER}/{sensor_id}.json", data, compact=True)
+
+    indice[sensor_id] = {
+        "descripcion": descripcion,
+        "unidad": unidad,
+        "archivo": f"{sensor_id}.json"
+    }
+
+    return data
+
+
+async def fetch_sensor(session, sem, r, perfil, indice, cache):
+
+    sensor_id = str(r["sensor_id"]).strip()
+    descripcion = str(r.get("descripcion", sensor_id))
+    unidad = str(r.get("unitat de mesura", r.get("unidad", "")) or "")
+
+    provider = str(r.get("provider_id", "") or "").strip()
+    if not provider:
+        provider = DEFAULT_PROVIDER_ID
+
+    # el calculado se resuelve después del gather (dependencias garantizadas)
+    if sensor_id == CALC_SENSOR_ID:
+        return
+
+    token = r.get("token")
+    if token is None:
+        token = TOKEN_FV if provider.upper().startswith("ARKENOVA") else TOKEN_STD
+
+    headers = HEADERS_FV if token == TOKEN_FV else HEADERS_STD
+
+    # la clasificación viene precalculada como columna; el fallback solo
+    # aplica si la fila no pasó por _run (p. ej. tests con dicts sueltos)
+    energia = bool(r["is_energia"]) if "is_energia" in r \
+        else es_energia(sensor_id, descripcion)
+    limit = perfil.limit_energia if energia else perfil.limit_instant
+    parser = _parse_energy if energia else _parse_avg
+
+    url = f"{SENTILO_URL}/{provider}/{sensor_id}"
+
+    obs = None
+    for intento in range(MAX_INTENTOS):
+        try:
+            async with sem:
+                async with session.get(url, headers=headers,
+                                       params={"limit": limit, "order": "desc"},
+                                       timeout=TIMEOUT_HTTP) as resp:
+                    # 5xx transitorio: forzamos excepción para reintentar
+                    if resp.status in RETRY_STATUS and intento < MAX_INTENTOS - 1:
+                        raise aiohttp.ClientResponseError(
+                            resp.request_info, resp.history, status=resp.status)
+                    resp.raise_for_status()
+                    # orjson sobre los bytes crudos: sin decode intermedio
+                    obs = json_loads(await resp.read()).get("observations", [])
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if intento < MAX_INTENTOS - 1:
+                await asyncio.sleep(0.5 * (2 ** intento))
+                continue
+            print(f"❌ {sensor_id}: error conexión: {e}")
+            return
+
+    # Sentilo viene DESC (último primero); recorremos al revés y las listas
+    # ya salen ASC, sin pasada extra de reverse()
+    ts_raw, values = [], []
+
+    for o in reversed(obs):
+        v = parser(o.get("value"))
+        if v is None:
+            continue
+        ts_raw.append(o["timestamp"])
+        values.append(v)
+
+    labels = parse_timestamps(ts_raw)
+
+    tipo_dato = "instantaneo" if limit == 1 else "consumo_intervalo"
+
+    # la escritura a disco va a un hilo: no bloquea el event loop y se
+    # solapa con las descargas que siguen en vuelo
+    cache[sensor_id] = await asyncio.to_thread(
+        guardar_sensor, indice, sensor_id, descripcion, unidad,
+        tipo_dato, labels, values)
+
+    print(f"✅ {sensor_id} – {descripcion} ({len(values)} puntos)")
+
+
+def _serie_por_minuto(labels, values):
+    """Serie float64 indexada por minuto (ante varios puntos en el mismo
+    minuto, se queda el último)."""
+    idx = pd.to_datetime(labels, errors="coerce").floor("min")
+    s = pd.Series(values, index=idx, dtype=np.float64)
+    s = s[s.index.notna()]
+    return s[~s.index.duplicated(keep="last")]
+
+
+def calcular_energia_cons(indice, cache, descripcion, unidad):
+    """CONS = IMPORTADA + FV, sobre las series ya descargadas."""
+
+    imp = cache.get("0190_MV_C1_ASB_ACTIVEE")
+    fv  = cache.get("0524_MV_FVENERGIA")
+
+    if not imp or not fv:
+        print(f"❌ {CALC_SENSOR_ID}: faltan sensores base")
+        return
+
+    # Cruce por MINUTO (no por segundo): cada proveedor estampa con jitter
+    # de segundos (:00:01 vs :15:02), así que el índice se trunca al minuto
+    # antes de combinar. Unión de minutos + ffill y fuera los puntos donde
+    # alguna base aún no tiene dato: un hueco puntual no emite un punto
+    # igual a un solo componente.
+    imp_s = _serie_por_minuto(imp["labels"], imp["values"])
+    fv_s  = _serie_por_minuto(fv["labels"], fv["values"])
+
+    df = pd.concat({"imp": imp_s, "fv": fv_s},
+                   axis=1).sort_index().ffill().dropna()
+    cons = df["imp"] + df["fv"]
+
+    labels = cons.index.strftime("%Y-%m-%dT%H:%M:00").tolist()
+    values = cons.to_numpy().tolist()
+
+    guardar_sensor(indice, CALC_SENSOR_ID, descripcion, unidad,
+                   "consumo_intervalo", labels, values)
+
+    print(f"✅ {CALC_SENSOR_ID} – CALCULADO ({len(values)} puntos)")
+
+
+async def _run(perfil):
+
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+
+    df = cargar_excel(perfil.excel)
+    if perfil.whitelist is not None:
+        # filtro lista blanca ANTES de cualquier trabajo por fila
+        # (strip vectorizado: ids con espacios en el Excel no se escapan)
+        ids = df["sensor_id"].astype("string").str.strip()
+        df = df[ids.isin(perfil.whitelist)].reset_index(drop=True)
+
+    # clasificación energía/instantáneo precalculada en columna, con la
+    # normalización NFD hecha de una vez sobre toda la columna (copy() para
+    # no tocar el DataFrame cacheado de cargar_excel)
+    df = df.copy()
+    desc_col = df["descripcion"] if "descripcion" in df.columns else df["sensor_id"]
+    df["descripcion_norm"] = (desc_col.astype(str).str.lower()
+                              .str.normalize("NFD")
+                              .str.encode("ascii", "ignore")
+                              .str.decode("ascii"))
+    sid_u = df["sensor_id"].astype(str).str.strip().str.upper()
+    df["is_energia"] = (sid_u.str.startswith("0190_MV_")
+                        | (sid_u == "0524_MV_FVENERGIA")
+                        | df["descripcion_norm"].str.contains("energia|energy",
+                                                              regex=True))
+
+    # provider y token por fila en asignaciones vectorizadas: el provider
+    # vacío cae al de SIGE y los sensores FV de ARKENOVA van con su token
+    if "provider_id" in df.columns:
+        prov = df["provider_id"].astype(str).str.strip()
+    else:
+        prov = pd.Series("", index=df.index)
+    df["provider_id"] = prov.where(prov != "", DEFAULT_PROVIDER_ID)
+    df["token"] = np.where(prov.str.upper().str.startswith("ARKENOVA", na=False),
+                           TOKEN_FV, TOKEN_STD)
+
+    # sin token la petición va a acabar en 401: mejor no quemar el RTT
+    # (caso típico: secret de CI sin definir)
+    sin_token = df[df["token"] == ""]
+    if len(sin_token):
+        print("⚠️ Sin token, se omiten: "
+              + ", ".join(sin_token["sensor_id"].astype(str)))
+        df = df[df["token"] != ""]
+
+    # materializamos las filas una sola vez: dicts planos en lugar de
+    # una Series por fila con iterrows() (el modo de iteración más lento de pandas)
+    rows = df.to_dict("records")
+
+    indice = {}
+    cache = {}
+
+    connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300)
+    sem = asyncio.Semaphore(perfil.max_concurrentes)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(fetch_sensor(session, sem, r, perfil,
+                                            indice, cache)
+                               for r in rows))
+
+    # ==================================================
+    # SENSOR CALCULADO (tras el gather: imp y fv ya en cache)
+    # ==================================================
+    calc_rows = [r for r in rows
+                 if str(r["sensor_id"]).strip() == CALC_SENSOR_ID]
+    if calc_rows:
+        r = calc_rows[0]
+        calcular_energia_cons(indice, cache,
+                              str(r.get("descripcion", CALC_SENSOR_ID)),
+                              str(r.get("unitat de mesura", "kWh") or "kWh"))
+
+    # ==================================================
+    # ÍNDICE
+    # ==================================================
+    atomic_write_json(perfil.index_json, {
+        "generado": datetime.now().isoformat(),
+        "sensores": indice
+    }, compact=True)
+
+    print(f"\n🚀 Perfil '{perfil.nombre}' actualizado ({len(indice)} sensores)")
+
+
+def run(perfil):
+    asyncio.run(_run(perfil))
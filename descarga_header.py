@@ -1,229 +1,16 @@
-import os
-import json
-import requests
-import pandas as pd
-import unicodedata
-from datetime import datetime
-
-# ==================================================
-# CONFIG
-# ==================================================
-SENTILO_URL = "http://connectaapi.bcn.cat/data"
-DATA_FOLDER = "datos_sensores"
-INDEX_JSON = "indice_sensores.json"
-
-LIMIT_ENERGIA = 96
-LIMIT_INSTANT = 1
-
-os.makedirs(DATA_FOLDER, exist_ok=True)
-
-TOKEN_STD = os.getenv("SENTILO_TOKEN", "").strip()
-TOKEN_FV  = os.getenv("SENTILO_TOKEN_FV", "").strip()
-
-# ==================================================
-# 🔥 SENSORES HEADER (LISTA BLANCA)
-# ==================================================
-HEADER_SENSORS = {
-
-    # energía base
-    "0190_MV_C1_ASB_ACTIVEE",
-    "0524_MV_FVENERGIA",
-    "0190_MV_CIA_EXPORT",
-    "0190_MV_ENERGIA_CONS",
-
-    # climatización
-    "0190_MV_C2_ASB_ACTIVEE",
-    "0190_MV_C41_CGEM21_EACTIVA",
-
-    # plantas
-    "0190_MV_C10_CGEM21_EACTIVA",
-    "0190_MV_C20_CGEM21_EACTIVA",
-    "0190_MV_C30_CGEM21_EACTIVA",
-    "0190_MV_C40_CGEM21_EACTIVA",
-    "0190_MV_C50_CGEM21_EACTIVA",
-
-    # temperatura / humedad plantas
-    "0190_HV_S1_STPRO_TEMP",
-    "0190_HV_S1_STPRO_HUM",
-    "0190_HV_S2_STPRO_TEMP",
-    "0190_HV_S2_STPRO_HUM",
-    "0190_HV_S3_STPRO_TEMP",
-    "0190_HV_S3_STPRO_HUM",
-    "0190_HV_S4_STPRO_TEMP",
-    "0190_HV_S4_STPRO_HUM",
-    "0190_HV_S5_STPRO_TEMP",
-    "0190_HV_S5_STPRO_HUM",
-
-    # FV ambiente
-    "0524_HV_TEMP_EXT",
-    "0524_HV_IRRAD",
-}
-
-# ==================================================
-# UTILS
-# ==================================================
-def normalizar(txt):
-    txt = str(txt).lower().strip()
-    txt = unicodedata.normalize("NFD", txt)
-    return "".join(c for c in txt if unicodedata.category(c) != "Mn")
-
-def es_energia(sensor_id, descripcion):
-    sid = sensor_id.upper()
-    desc = normalizar(descripcion)
-    return sid.startswith("0190_MV_") or "energia" in desc
-
-def parse_timestamp(ts):
-    try:
-        return datetime.strptime(ts, "%d/%m/%YT%H:%M:%S").isoformat()
-    except:
-        return ts
-
-def parse_value(sensor_id, descripcion, raw):
-    try:
-        data = json.loads(raw)
-        s = data.get("summary", {})
-
-        if es_energia(sensor_id, descripcion):
-            if "firstvalue" in s and "lastvalue" in s:
-                return float(s["lastvalue"]) - float(s["firstvalue"])
-        else:
-            if "avg" in s:
-                return float(s["avg"])
-    except:
-        pass
-    return None
-
-# ==================================================
-# CARGA EXCEL + FILTRO HEADER
-# ==================================================
-df = pd.read_excel("Relación sensores AVINYÓ.xls")
-df.columns = [c.strip().lower() for c in df.columns]
-
-df = df[df["sensor_id"].isin(HEADER_SENSORS)]
-
-# ==================================================
-# DESCARGA
-# ==================================================
-indice = {}
-cache = {}
-
-for _, r in df.iterrows():
-
-    sensor_id = str(r["sensor_id"]).strip()
-    descripcion = str(r.get("descripcion", sensor_id))
-    unidad = str(r.get("unitat de mesura", ""))
-
-    provider = str(r.get("provider_id", "")).strip()
-
-    print(f"\n📡 {sensor_id} – {descripcion}")
-
-    # ==================================================
-    # SENSOR CALCULADO
-    # ==================================================
-    if sensor_id == "0190_MV_ENERGIA_CONS":
-
-        imp = cache.get("0190_MV_C1_ASB_ACTIVEE")
-        fv  = cache.get("0524_MV_FVENERGIA")
-
-        if not imp or not fv:
-            print("   ❌ Faltan sensores base")
-            continue
-
-        n = min(len(imp["values"]), len(fv["values"]))
-
-        labels = imp["labels"][-n:]
-        values = [
-            imp["values"][-n+i] + fv["values"][-n+i]
-            for i in range(n)
-        ]
-
-        data = {
-            "sensor_id": sensor_id,
-            "descripcion": descripcion,
-            "unidad": unidad,
-            "tipo_dato": "consumo_intervalo",
-            "labels": labels,
-            "values": values
-        }
-
-        with open(f"{DATA_FOLDER}/{sensor_id}.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-
-        indice[sensor_id] = {
-            "descripcion": descripcion,
-            "unidad": unidad,
-            "archivo": f"{sensor_id}.json"
-        }
-
-        print(f"   ✅ CALCULADO ({len(values)} puntos)")
-        continue
-
-    # ==================================================
-    # SENSOR REAL
-    # ==================================================
-    token = TOKEN_FV if provider.upper().startswith("ARKENOVA") else TOKEN_STD
-
-    headers = {
-        "IDENTITY_KEY": token,
-        "Accept": "application/json"
-    }
-
-    limit = LIMIT_ENERGIA if es_energia(sensor_id, descripcion) else LIMIT_INSTANT
-
-    url = f"{SENTILO_URL}/{provider}/{sensor_id}"
-
-    try:
-        r = requests.get(url, headers=headers,
-                         params={"limit": limit, "order": "desc"},
-                         timeout=20)
-        r.raise_for_status()
-        obs = r.json().get("observations", [])
-    except Exception as e:
-        print(f"   ❌ Error conexión: {e}")
-        continue
-
-    labels, values = [], []
-
-    for o in obs:
-        v = parse_value(sensor_id, descripcion, o.get("value"))
-        if v is None:
-            continue
-        labels.append(parse_timestamp(o["timestamp"]))
-        values.append(v)
-
-    labels.reverse()
-    values.reverse()
-
-    data = {
-        "sensor_id": sensor_id,
-        "descripcion": descripcion,
-        "unidad": unidad,
-        "tipo_dato": "instantaneo" if limit == 1 else "consumo_intervalo",
-        "labels": labels,
-        "values": values
-    }
-
-    with open(f"{DATA_FOLDER}/{sensor_id}.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-    cache[sensor_id] = data
-
-    indice[sensor_id] = {
-        "descripcion": descripcion,
-        "unidad": unidad,
-        "archivo": f"{sensor_id}.json"
-    }
-
-    print(f"   ✅ OK ({len(values)} puntos)")
-
-# ==================================================
-# ÍNDICE
-# ==================================================
-with open(INDEX_JSON, "w", encoding="utf-8") as f:
-    json.dump({
-        "generado": datetime.now().isoformat(),
-        "sensores": indice
-    }, f, indent=2, ensure_ascii=False)
-
-print("\n🚀 HEADER actualizado correctamente")
-
+"""Descarga de los sensores del HEADER (lista blanca) para el dashboard.
+
+El flujo real vive en descarga_core.run(); aquí solo se define el perfil.
+"""
+
+from descarga_core import HEADER_SENSORS, Perfil, run
+
+PERFIL_HEADER = Perfil(
+    nombre="header",
+    whitelist=HEADER_SENSORS,
+    limit_energia=96,   # ~1 día de cuartohorarios
+    limit_instant=1,
+)
+
+if __name__ == "__main__":
+    run(PERFIL_HEADER)
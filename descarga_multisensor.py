@@ -1,415 +1,555 @@
-import os
-import json
-import time
-import requests
-import pandas as pd
-import unicodedata
-from datetime import datetime
-
-# ==================================================
-# CONFIGURACIÓN
-# ==================================================
-SENTILO_URL = "http://connectaapi.bcn.cat/data"
-
-EXCEL_FILE = "Relación sensores AVINYÓ.xls"
-DATA_FOLDER = "datos_sensores"
-INDEX_JSON = "indice_sensores.json"
-
-LIMIT = 250  # suficiente para ~2 días
-
-os.makedirs(DATA_FOLDER, exist_ok=True)
-
-# Tokens (GitHub Secrets)
-TOKEN_DEFAULT = os.getenv("SENTILO_TOKEN", "").strip()
-TOKEN_FV = os.getenv("SENTILO_TOKEN_FV", "").strip()
-
-if not TOKEN_DEFAULT:
-    raise RuntimeError("❌ SENTILO_TOKEN no está definido en GitHub Secrets.")
-
-print("=" * 70)
-print(" DESCARGA SENSORES SENTILO → DASHBOARD HTML ")
-print("=" * 70)
-
-# ==================================================
-# FUNCIONES AUXILIARES
-# ==================================================
-def normalizar(texto):
-    texto = str(texto).lower()
-    texto = unicodedata.normalize("NFD", texto)
-    return "".join(c for c in texto if unicodedata.category(c) != "Mn")
-
-
-def es_energia(sensor_id: str, descripcion: str) -> bool:
-    """
-    Reglas:
-    - sensor_id empieza por 0190_MV_  (contadores)
-    - o descripcion contiene energia/energy
-    - o sensor FV energia producida (0524_MV_FVENERGIA) también es contador
-    """
-    sid = str(sensor_id).strip().upper()
-    desc = normalizar(descripcion)
-
-    if sid.startswith("0190_MV_"):
-        return True
-
-    if sid == "0524_MV_FVENERGIA":
-        return True
-
-    if "energia" in desc or "energy" in desc:
-        return True
-
-    return False
-
-
-def tipo_dato_por_sensor(sensor_id: str, descripcion: str) -> str:
-    return "consumo_intervalo" if es_energia(sensor_id, descripcion) else "instantaneo"
-
-
-def parse_timestamp(ts):
-    """
-    Sentilo devuelve timestamps tipo: 13/08/2025T07:45:01
-    """
-    try:
-        return datetime.strptime(ts, "%d/%m/%YT%H:%M:%S").isoformat()
-    except:
-        return ts
-
-
-def minute_key(iso_ts: str) -> str:
-    """
-    Convierte un ISO timestamp a clave por minuto: YYYY-MM-DDTHH:MM
-    """
-    try:
-        dt = datetime.fromisoformat(iso_ts)
-        return dt.strftime("%Y-%m-%dT%H:%M")
-    except:
-        return str(iso_ts)[:16]
-
-
-def parse_value(sensor_id: str, descripcion: str, value_raw: str):
-    """
-    - Energía -> lastvalue - firstvalue
-    - Resto -> avg
-    """
-    try:
-        data = json.loads(value_raw)
-        summary = data.get("summary", {})
-
-        if es_energia(sensor_id, descripcion):
-            if "firstvalue" in summary and "lastvalue" in summary:
-                return float(summary["lastvalue"]) - float(summary["firstvalue"])
-            return None
-
-        # no energía
-        if "avg" in summary:
-            return float(summary["avg"])
-
-    except Exception:
-        pass
-
-    return None
-
-
-def get_headers_for_token(token: str):
-    return {
-        "IDENTITY_KEY": token,
-        "Accept": "application/json"
-    }
-
-
-def fetch_sensor_observations(provider_id: str, sensor_id: str, token: str):
-    url = f"{SENTILO_URL}/{provider_id}/{sensor_id}"
-    params = {
-        "limit": LIMIT,
-        "order": "desc"
-    }
-
-    r = requests.get(url, headers=get_headers_for_token(token), params=params, timeout=30)
-    if r.status_code != 200:
-        raise RuntimeError(f"HTTP {r.status_code}: {r.text[:250]}")
-
-    data = r.json()
-    return data.get("observations", [])
-
-
-def build_sensor_json(sensor_id: str, descripcion: str, unidad: str, observations: list):
-    labels = []
-    values = []
-
-    for obs in observations:
-        ts = obs.get("timestamp")
-        raw = obs.get("value")
-
-        if not ts or not raw:
-            continue
-
-        value = parse_value(sensor_id, descripcion, raw)
-        if value is None:
-            continue
-
-        labels.append(parse_timestamp(ts))
-        values.append(float(value))
-
-    # Sentilo viene DESC -> invertimos a ASC
-    labels.reverse()
-    values.reverse()
-
-    return {
-        "sensor_id": sensor_id,
-        "descripcion": descripcion,
-        "unidad": unidad,
-        "tipo_dato": tipo_dato_por_sensor(sensor_id, descripcion),
-        "labels": labels,
-        "values": values
-    }
-
-
-def to_minute_map(labels, values):
-    """
-    Convierte arrays en dict minute_key -> value
-    Si hay varios puntos en el mismo minuto, nos quedamos con el último.
-    """
-    m = {}
-    for t, v in zip(labels, values):
-        k = minute_key(t)
-        m[k] = v
-    return m
-
-
-def forward_fill_get(m: dict, k: str, last_value):
-    """
-    Devuelve m[k] si existe, sino devuelve last_value (forward fill).
-    """
-    if k in m:
-        return m[k], m[k]
-    return last_value, last_value
-
-
-def calcular_energia_total_consumida_v2(importada_json, fv_json):
-    """
-    CONS = IMPORTADA + FV
-    - Cruce por MINUTO (no por segundo)
-    - Usamos UNIÓN de minutos (no intersección)
-    - Forward fill para no perder el último punto si uno viene con 1 lectura menos
-    """
-    imp = to_minute_map(importada_json["labels"], importada_json["values"])
-    fv  = to_minute_map(fv_json["labels"], fv_json["values"])
-
-    # unión de todos los minutos
-    timeline = sorted(set(imp.keys()) | set(fv.keys()))
-
-    labels = []
-    values = []
-
-    last_imp = None
-    last_fv = None
-
-    for k in timeline:
-        last_imp, _ = forward_fill_get(imp, k, last_imp)
-        last_fv, _ = forward_fill_get(fv, k, last_fv)
-
-        # si al principio aún no hay dato de alguno, saltamos
-        if last_imp is None or last_fv is None:
-            continue
-
-        cons = last_imp + last_fv
-        labels.append(k + ":00")
-        values.append(float(cons))
-
-    return labels, values
-
-
-def clean_cell(value) -> str:
-    """
-    Convierte NaN / None / 'nan' / 'None' a string vacío.
-    """
-    if value is None:
-        return ""
-    if isinstance(value, float) and pd.isna(value):
-        return ""
-    s = str(value).strip()
-    if s.lower() in ["nan", "none", "null"]:
-        return ""
-    return s
-
-
-# ==================================================
-# CARGA EXCEL
-# ==================================================
-df = pd.read_excel(EXCEL_FILE)
-df.columns = [c.strip().lower() for c in df.columns]
-
-if "sensor_id" not in df.columns:
-    raise ValueError(f"❌ Falta columna 'sensor_id' en el Excel. Columnas: {list(df.columns)}")
-
-# Columnas opcionales
-col_desc = "descripcion" if "descripcion" in df.columns else None
-col_unit = "unitat de mesura" if "unitat de mesura" in df.columns else ("unidad" if "unidad" in df.columns else None)
-col_type = "tipus de dada" if "tipus de dada" in df.columns else ("tipo_dato" if "tipo_dato" in df.columns else None)
-
-# Nuevas columnas para multi-provider/token
-col_provider = "provider_id" if "provider_id" in df.columns else None
-col_tokenenv = "token_env" if "token_env" in df.columns else None
-
-# Provider por defecto (si no viene en Excel)
-DEFAULT_PROVIDER_ID = "SIGE_PR_0190"
-
-# ==================================================
-# DESCARGA / CÁLCULO DE SENSORES
-# ==================================================
-indice_sensores = {}
-cache_json = {}  # para reutilizar sensores descargados en cálculos
-
-
-def guardar_sensor(sensor_json, descripcion, unidad):
-    sensor_id = sensor_json["sensor_id"]
-    filename = f"{sensor_id}.json"
-    out_path = os.path.join(DATA_FOLDER, filename)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(sensor_json, f, indent=2, ensure_ascii=False)
-
-    indice_sensores[sensor_id] = {
-        "descripcion": descripcion,
-        "unidad": unidad,
-        "tipo_dato": sensor_json["tipo_dato"],
-        "archivo": filename
-    }
-
-
-for _, row in df.iterrows():
-
-    sensor_id = clean_cell(row.get("sensor_id", ""))
-    if not sensor_id:
-        continue
-
-    descripcion = clean_cell(row.get(col_desc, sensor_id)) if col_desc else sensor_id
-    unidad = clean_cell(row.get(col_unit, "")) if col_unit else ""
-    tipo_excel = clean_cell(row.get(col_type, "JSON")).upper() if col_type else "JSON"
-
-    # si existe la columna tipo y NO es JSON, saltamos
-    if col_type and tipo_excel != "JSON":
-        continue
-
-    provider_id = clean_cell(row.get(col_provider, "")) if col_provider else ""
-    token_env = clean_cell(row.get(col_tokenenv, "")) if col_tokenenv else ""
-
-    # ----------------------------
-    # SENSOR CALCULADO (ficticio)
-    # ----------------------------
-    if provider_id == "" and token_env == "":
-        if sensor_id.upper() != "0190_MV_ENERGIA_CONS":
-            print(f"\n🧮 {sensor_id} – {descripcion}")
-            print("   ⚠️ Sensor calculado desconocido (no implementado). Saltando.")
-            continue
-
-        print(f"\n🧮 {sensor_id} – {descripcion} (CALCULADO)")
-
-        SENSOR_IMPORTADA = "0190_MV_C1_ASB_ACTIVEE"
-        SENSOR_FV = "0524_MV_FVENERGIA"
-
-        def ensure_in_cache(sid):
-            if sid in cache_json:
-                return cache_json[sid]
-
-            if sid == SENSOR_FV:
-                provider = "ARKENOVA_0524"
-                token = TOKEN_FV
-                if not token:
-                    raise RuntimeError("❌ Falta SENTILO_TOKEN_FV para leer sensores FV.")
-            else:
-                provider = DEFAULT_PROVIDER_ID
-                token = TOKEN_DEFAULT
-
-            print(f"   ↳ descargando base: {sid} ({provider})")
-            obs = fetch_sensor_observations(provider, sid, token)
-
-            sj = build_sensor_json(sid, sid, "kWh", obs)
-            cache_json[sid] = sj
-            return sj
-
-        try:
-            imp_json = ensure_in_cache(SENSOR_IMPORTADA)
-            fv_json  = ensure_in_cache(SENSOR_FV)
-
-            labels, values = calcular_energia_total_consumida_v2(imp_json, fv_json)
-
-            if not values:
-                print("   ⚠️ No se han podido calcular puntos.")
-                continue
-
-            sensor_json = {
-                "sensor_id": sensor_id,
-                "descripcion": descripcion,
-                "unidad": unidad if unidad else "kWh",
-                "tipo_dato": "consumo_intervalo",
-                "labels": labels,
-                "values": values
-            }
-
-            guardar_sensor(sensor_json, descripcion, sensor_json["unidad"])
-            cache_json[sensor_id] = sensor_json
-
-            print(f"   ✅ OK ({len(values)} puntos calculados)")
-
-        except Exception as e:
-            print(f"   ❌ Error calculando {sensor_id}: {e}")
-
-        continue
-
-    # ----------------------------
-    # SENSOR NORMAL (Sentilo)
-    # ----------------------------
-    if not provider_id:
-        provider_id = DEFAULT_PROVIDER_ID
-
-    token_to_use = TOKEN_DEFAULT
-
-    if token_env:
-        token_to_use = os.getenv(token_env, "").strip()
-
-    if not token_to_use:
-        print(f"\n📡 {sensor_id} – {descripcion}")
-        print(f"   ❌ Token vacío. Revisa token_env='{token_env}' o GitHub Secrets.")
-        continue
-
-    print(f"\n📡 {sensor_id} – {descripcion}")
-
-    try:
-        observations = fetch_sensor_observations(provider_id, sensor_id, token_to_use)
-
-        if not observations:
-            print("   ⚠️ Sin observaciones")
-            continue
-
-        sensor_json = build_sensor_json(sensor_id, descripcion, unidad, observations)
-
-        if not sensor_json["values"]:
-            print("   ⚠️ Sin valores válidos")
-            continue
-
-        guardar_sensor(sensor_json, descripcion, unidad)
-        cache_json[sensor_id] = sensor_json
-
-        print(f"   ✅ OK ({len(sensor_json['values'])} puntos)")
-
-        time.sleep(0.15)
-
-    except Exception as e:
-        print(f"   ❌ Error conexión: {e}")
-        continue
-
-
-# ==================================================
-# ÍNDICE PARA DASHBOARD
-# ==================================================
-indice = {
-    "generado": datetime.now().isoformat(),
-    "sensores": indice_sensores
-}
-
-with open(INDEX_JSON, "w", encoding="utf-8") as f:
-    json.dump(indice, f, indent=2, ensure_ascii=False)
-
-print("\n✅ DESCARGA COMPLETADA")
-print(f"📁 Sensores válidos: {len(indice_sensores)}")
+import asyncio
+import os
+import time
+import aiohttp
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from descarga_core import (atomic_write_json, cargar_excel, es_energia,
+                           json_dump_bytes, json_loads, parse_timestamps)
+
+# parseo incremental de la respuesta (opcional): procesa observación a
+# observación sin materializar el dict completo de la respuesta
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# ==================================================
+# CONFIGURACIÓN
+# ==================================================
+SENTILO_URL = "http://connectaapi.bcn.cat/data"
+
+EXCEL_FILE = "Relación sensores AVINYÓ.xls"
+DATA_FOLDER = "datos_sensores"
+INDEX_JSON = "indice_sensores.json"
+
+LIMIT = 250  # suficiente para ~2 días
+
+# OUTPUT_MODE agrupa la salida en un solo archivo en vez de uno por
+# sensor (O(1) aperturas/inodes; útil en HDD/NFS o artefactos de CI):
+#   jsonl  -> datos_sensores.jsonl, una línea compacta por sensor
+#   bundle -> sensores_all.json, un objeto {sensor_id: sensor_json} que el
+#             dashboard puede cargar con una única petición HTTP
+# Por defecto (files) se mantiene el archivo-por-sensor actual.
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "files")
+BUNDLE_JSONL = "datos_sensores.jsonl"
+BUNDLE_JSON = "sensores_all.json"
+
+# SENTILO_CACHE_TTL>0 (segundos) memoiza las respuestas en .cache/:
+# re-ejecuciones dentro del TTL (desarrollo, reintentos de CI) no tocan
+# la red. Apagado por defecto: en producción los datos deben ser frescos.
+CACHE_TTL = float(os.getenv("SENTILO_CACHE_TTL", "0"))
+CACHE_DIR = ".cache"
+
+os.makedirs(DATA_FOLDER, exist_ok=True)
+
+# Tokens (GitHub Secrets)
+TOKEN_DEFAULT = os.getenv("SENTILO_TOKEN", "").strip()
+TOKEN_FV = os.getenv("SENTILO_TOKEN_FV", "").strip()
+
+if not TOKEN_DEFAULT:
+    raise RuntimeError("❌ SENTILO_TOKEN no está definido en GitHub Secrets.")
+
+# Descarga asíncrona: todas las peticiones comparten una ClientSession
+# (keep-alive, pool por host) y un semáforo acota cuántas van en vuelo.
+MAX_CONCURRENTES = 16
+MAX_INTENTOS = 3
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# abortar rápido conexiones colgadas sin renunciar al margen de lectura
+TIMEOUT_HTTP = aiohttp.ClientTimeout(total=20, connect=5)
+HEADERS_BASE = {
+    "Accept": "application/json",
+    "User-Agent": "dashboard-edificio/1.0",
+    # el token estándar viaja una vez a nivel de sesión; solo los sensores
+    # con token propio (FV) lo sobreescriben por petición
+    "IDENTITY_KEY": TOKEN_DEFAULT
+}
+
+print("=" * 70)
+print(" DESCARGA SENSORES SENTILO → DASHBOARD HTML ")
+print("=" * 70)
+
+# ==================================================
+# FUNCIONES AUXILIARES
+# ==================================================
+# normalizar / es_energia viven ahora en descarga_core (compartidos con
+# los perfiles header)
+
+def tipo_dato_por_sensor(sensor_id: str, descripcion: str) -> str:
+    return "consumo_intervalo" if es_energia(sensor_id, descripcion) else "instantaneo"
+
+
+def _float_o_nan(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# los timestamps se convierten en bloque con descarga_core.parse_timestamps
+# (parser C de pandas sobre la lista completa, no strptime por observación)
+
+def get_headers_for_token(token: str):
+    # None = usar las cabeceras de la sesión tal cual (token estándar);
+    # solo un token distinto obliga a construir el dict de override
+    if token == TOKEN_DEFAULT:
+        return None
+    return {"IDENTITY_KEY": token}
+
+
+def _cache_leer(path):
+    try:
+        if time.time() - os.path.getmtime(path) < CACHE_TTL:
+            with open(path, "rb") as f:
+                return json_loads(f.read())
+    except OSError:
+        pass  # sin cache o caducada
+    return None
+
+
+def _cache_escribir(path, observations):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    try:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json_dump_bytes(observations, compact=True))
+        os.replace(tmp, path)
+    except (OSError, TypeError):
+        pass  # la cache es best-effort: si no se puede escribir, seguimos
+
+
+async def fetch_sensor_observations(session, provider_id: str, sensor_id: str, token: str):
+    url = f"{SENTILO_URL}/{provider_id}/{sensor_id}"
+    params = {
+        "limit": LIMIT,
+        "order": "desc"
+    }
+
+    cache_path = os.path.join(CACHE_DIR, f"{provider_id}_{sensor_id}_{LIMIT}.json")
+    if CACHE_TTL > 0:
+        cacheadas = _cache_leer(cache_path)
+        if cacheadas is not None:
+            return cacheadas
+
+    for intento in range(MAX_INTENTOS):
+        async with session.get(url, headers=get_headers_for_token(token),
+                               params=params, timeout=TIMEOUT_HTTP) as r:
+            if r.status == 200:
+                if ijson is not None:
+                    # stream: ijson detecta el reader asíncrono de aiohttp y
+                    # el parseo solapa con la recepción, observación a
+                    # observación
+                    observations = [obs async for obs in
+                                    ijson.items(r.content, "observations.item")]
+                else:
+                    # orjson parsea los bytes crudos directamente: ni decode
+                    # a str ni la detección de charset de Response.json()
+                    data = json_loads(await r.read())
+                    observations = data.get("observations", [])
+
+                if CACHE_TTL > 0:
+                    _cache_escribir(cache_path, observations)
+                return observations
+
+            if r.status in RETRY_STATUS and intento < MAX_INTENTOS - 1:
+                # backoff exponencial en 429/5xx; si la API manda
+                # Retry-After, respetamos su espera en vez de la nuestra
+                espera = 0.5 * 2 ** intento
+                retry_after = r.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    espera = max(espera, int(retry_after))
+                await asyncio.sleep(espera)
+                continue
+
+            cuerpo = (await r.text())[:250]
+            raise RuntimeError(f"HTTP {r.status}: {cuerpo}")
+
+
+def build_sensor_json(sensor_id: str, descripcion: str, unidad: str, observations: list):
+    is_energy = es_energia(sensor_id, descripcion)
+
+    # 1) parsear todos los summaries embebidos de una vez
+    ts_raw = []
+    summaries = []
+    for obs in observations:
+        ts = obs.get("timestamp")
+        raw = obs.get("value")
+        if not ts or not raw:
+            continue
+        try:
+            summaries.append(json_loads(raw).get("summary", {}))
+        except Exception:
+            continue
+        ts_raw.append(ts)
+
+    n = len(summaries)
+
+    # 2) extraer los campos a arrays y operar vectorizado
+    #    (energía = resta lastvalue-firstvalue en un solo paso NumPy)
+    if is_energy:
+        firsts = np.fromiter((_float_o_nan(s.get("firstvalue")) for s in summaries),
+                             dtype=np.float64, count=n)
+        lasts = np.fromiter((_float_o_nan(s.get("lastvalue")) for s in summaries),
+                            dtype=np.float64, count=n)
+        vals = lasts - firsts
+    else:
+        vals = np.fromiter((_float_o_nan(s.get("avg")) for s in summaries),
+                           dtype=np.float64, count=n)
+
+    # Sentilo viene DESC -> a ASC invirtiendo el array con un slice C
+    # ([::-1] sobre el ndarray es una vista, no una copia elemento a elemento)
+    mask = ~np.isnan(vals)
+    values = vals[mask][::-1].tolist()
+    ts_validos = [ts for ts, ok in zip(ts_raw, mask) if ok][::-1]
+
+    # conversión de timestamps en una sola pasada vectorizada (ya en ASC)
+    labels = parse_timestamps(ts_validos)
+
+    return {
+        "sensor_id": sensor_id,
+        "descripcion": descripcion,
+        "unidad": unidad,
+        "tipo_dato": "consumo_intervalo" if is_energy else "instantaneo",
+        "labels": labels,
+        "values": values
+    }
+
+
+def _serie_por_minuto(sensor_json):
+    """Serie pandas indexada por minuto (si hay varios puntos en el mismo
+    minuto, nos quedamos con el último)."""
+    idx = pd.to_datetime(sensor_json["labels"], errors="coerce").floor("min")
+    s = pd.Series(sensor_json["values"], index=idx, dtype="float64")
+    s = s[s.index.notna()]
+    return s[~s.index.duplicated(keep="last")]
+
+
+def calcular_energia_total_consumida_v2(importada_json, fv_json):
+    """
+    CONS = IMPORTADA + FV
+    - Cruce por MINUTO (no por segundo)
+    - Usamos UNIÓN de minutos (no intersección)
+    - Forward fill para no perder el último punto si uno viene con 1 lectura menos
+
+    Todo el cruce (unión de minutos + sort + ffill + suma) son kernels C
+    de pandas en una pasada, en lugar de tres dicts y un bucle Python
+    por minuto.
+    """
+    df = pd.concat({"imp": _serie_por_minuto(importada_json),
+                    "fv": _serie_por_minuto(fv_json)},
+                   axis=1).sort_index().ffill().dropna()
+
+    cons = df["imp"] + df["fv"]
+    labels = cons.index.strftime("%Y-%m-%dT%H:%M:00").tolist()
+    return labels, cons.tolist()
+
+
+# ==================================================
+# CARGA EXCEL
+# ==================================================
+df = cargar_excel(EXCEL_FILE)
+
+if "sensor_id" not in df.columns:
+    raise ValueError(f"❌ Falta columna 'sensor_id' en el Excel. Columnas: {list(df.columns)}")
+
+# Columnas opcionales
+col_desc = "descripcion" if "descripcion" in df.columns else None
+col_unit = "unitat de mesura" if "unitat de mesura" in df.columns else ("unidad" if "unidad" in df.columns else None)
+col_type = "tipus de dada" if "tipus de dada" in df.columns else ("tipo_dato" if "tipo_dato" in df.columns else None)
+
+# Nuevas columnas para multi-provider/token
+col_provider = "provider_id" if "provider_id" in df.columns else None
+col_tokenenv = "token_env" if "token_env" in df.columns else None
+
+# Limpieza vectorizada de celdas (antes era clean_cell por celda y por fila):
+# strip + NaN/'nan'/'none'/'null' -> "" en una pasada C por columna.
+# copy() para no tocar el DataFrame cacheado de cargar_excel.
+df = df.copy()
+for _c in ["sensor_id"] + [c for c in (col_desc, col_unit, col_type,
+                                       col_provider, col_tokenenv) if c]:
+    _col = df[_c].astype("string").str.strip().fillna("")
+    df[_c] = _col.mask(_col.str.lower().isin(["nan", "none", "null"]), "")
+
+# filas sin sensor_id fuera antes de iterar
+df = df[df["sensor_id"] != ""]
+
+# Provider por defecto (si no viene en Excel)
+DEFAULT_PROVIDER_ID = "SIGE_PR_0190"
+
+# ==================================================
+# DESCARGA / CÁLCULO DE SENSORES
+# ==================================================
+# el índice se acumula como lista de registros (un append por sensor,
+# seguro entre hilos de escritura) y se convierte a dict una sola vez al
+# final, justo antes de serializar
+registros_indice = []
+cache_json = {}  # para reutilizar sensores descargados en cálculos
+
+
+registros_jsonl = []  # modos agrupados (jsonl/bundle): se vuelca todo al final
+
+
+def guardar_sensor(sensor_json, descripcion, unidad):
+    sensor_id = sensor_json["sensor_id"]
+
+    if OUTPUT_MODE == "jsonl":
+        registros_jsonl.append(sensor_json)
+        filename = BUNDLE_JSONL
+    elif OUTPUT_MODE == "bundle":
+        registros_jsonl.append(sensor_json)
+        filename = BUNDLE_JSON
+    else:
+        filename = f"{sensor_id}.json"
+        atomic_write_json(os.path.join(DATA_FOLDER, filename),
+                          sensor_json, compact=True)
+
+    registros_indice.append((sensor_id, {
+        "descripcion": descripcion,
+        "unidad": unidad,
+        "tipo_dato": sensor_json["tipo_dato"],
+        "archivo": filename
+    }))
+
+
+def escribir_bundle_jsonl():
+    """Una línea compacta por sensor, serializado entero en memoria y
+    escrito de una vez (tmp + replace, como atomic_write_json)."""
+    payload = b"\n".join(json_dump_bytes(r, compact=True)
+                         for r in registros_jsonl) + b"\n"
+    tmp = f"{BUNDLE_JSONL}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+    os.replace(tmp, BUNDLE_JSONL)
+
+
+class TokenBucket:
+    """Limitador de ritmo: permite ráfagas hasta `capacity` y solo espera
+    cuando el cubo se vacía (a diferencia del sleep fijo tras cada petición).
+
+    Todas las corrutinas viven en el mismo event loop, así que la
+    contabilidad no necesita lock; la espera es asyncio.sleep (no bloquea
+    el resto de descargas)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.cap = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            espera = (1 - self.tokens) / self.rate
+            self.tokens = 0.0
+            await asyncio.sleep(espera)
+        else:
+            self.tokens -= 1
+
+
+# Ritmo configurable sin tocar código: SENTILO_SLEEP son los segundos
+# mínimos entre peticiones (0 = sin límite de ritmo, solo el semáforo).
+# Por defecto ~7 req/s sostenidas (equivale al antiguo sleep(0.15)).
+_SLEEP = float(os.getenv("SENTILO_SLEEP", "0.15"))
+BUCKET = TokenBucket(rate=1 / _SLEEP, capacity=8) if _SLEEP > 0 else None
+
+
+async def descargar_sensor(session, sem, args):
+    """Etapa de red: petición HTTP acotada por el semáforo; el parseo y la
+    escritura se despachan a un hilo para no bloquear el event loop."""
+    sensor_id, _descripcion, _unidad, provider_id, token_to_use = args
+
+    try:
+        if BUCKET is not None:
+            await BUCKET.acquire()
+        async with sem:
+            observations = await fetch_sensor_observations(
+                session, provider_id, sensor_id, token_to_use)
+    except Exception as e:
+        print(f"❌ {sensor_id}: error conexión: {e}")
+        return
+
+    await asyncio.to_thread(procesar_y_guardar, args, observations)
+
+
+def procesar_y_guardar(args, observations):
+    """Etapa de parseo + escritura: corre en el mismo pool, solapada con
+    las descargas que siguen en vuelo."""
+    sensor_id, descripcion, unidad, _provider_id, _token = args
+
+    try:
+        if not observations:
+            print(f"⚠️ {sensor_id}: sin observaciones")
+            return
+
+        sensor_json = build_sensor_json(sensor_id, descripcion, unidad, observations)
+
+        if not sensor_json["values"]:
+            print(f"⚠️ {sensor_id}: sin valores válidos")
+            return
+
+        guardar_sensor(sensor_json, descripcion, unidad)
+        cache_json[sensor_id] = sensor_json
+
+        print(f"✅ {sensor_id} – {descripcion} ({len(sensor_json['values'])} puntos)")
+
+    except Exception as e:
+        print(f"❌ {sensor_id}: error procesando: {e}")
+
+
+# sensores base del calculado
+SENSOR_IMPORTADA = "0190_MV_C1_ASB_ACTIVEE"
+SENSOR_FV = "0524_MV_FVENERGIA"
+
+
+async def ensure_in_cache(session, sid):
+    """Devuelve el JSON del sensor base, bajándolo solo si la pasada
+    principal no lo dejó ya en cache_json."""
+    if sid in cache_json:
+        return cache_json[sid]
+
+    if sid == SENSOR_FV:
+        provider = "ARKENOVA_0524"
+        token = TOKEN_FV
+        if not token:
+            raise RuntimeError("❌ Falta SENTILO_TOKEN_FV para leer sensores FV.")
+    else:
+        provider = DEFAULT_PROVIDER_ID
+        token = TOKEN_DEFAULT
+
+    print(f"   ↳ descargando base: {sid} ({provider})")
+    obs = await fetch_sensor_observations(session, provider, sid, token)
+
+    sj = build_sensor_json(sid, sid, "kWh", obs)
+    cache_json[sid] = sj
+    return sj
+
+
+async def procesar_calculado(session, sensor_id, descripcion, unidad):
+    """Sensor ficticio CONS = IMPORTADA + FV. Corre tras el gather, con
+    las bases normalmente ya en cache_json."""
+
+    if sensor_id.upper() != "0190_MV_ENERGIA_CONS":
+        print(f"\n🧮 {sensor_id} – {descripcion}")
+        print("   ⚠️ Sensor calculado desconocido (no implementado). Saltando.")
+        return
+
+    print(f"\n🧮 {sensor_id} – {descripcion} (CALCULADO)")
+
+    try:
+        imp_json = await ensure_in_cache(session, SENSOR_IMPORTADA)
+        fv_json  = await ensure_in_cache(session, SENSOR_FV)
+
+        labels, values = calcular_energia_total_consumida_v2(imp_json, fv_json)
+
+        if not values:
+            print("   ⚠️ No se han podido calcular puntos.")
+            return
+
+        sensor_json = {
+            "sensor_id": sensor_id,
+            "descripcion": descripcion,
+            "unidad": unidad if unidad else "kWh",
+            "tipo_dato": "consumo_intervalo",
+            "labels": labels,
+            "values": values
+        }
+
+        guardar_sensor(sensor_json, descripcion, sensor_json["unidad"])
+        cache_json[sensor_id] = sensor_json
+
+        print(f"   ✅ OK ({len(values)} puntos calculados)")
+
+    except Exception as e:
+        print(f"   ❌ Error calculando {sensor_id}: {e}")
+
+
+# Primera pasada, íntegramente vectorizada: columnas derivadas con kernels
+# de pandas y separación reales/calculados por máscaras — sin bucle Python
+# por fila (las celdas ya llegan limpias de la pasada anterior).
+if col_desc:
+    df["descripcion"] = df[col_desc].where(df[col_desc] != "", df["sensor_id"])
+else:
+    df["descripcion"] = df["sensor_id"]
+df["unidad"] = df[col_unit] if col_unit else ""
+
+# si existe la columna tipo y NO es JSON, la fila queda fuera
+if col_type:
+    df = df[df[col_type].str.upper() == "JSON"]
+
+prov = df[col_provider] if col_provider else pd.Series("", index=df.index)
+tenv = df[col_tokenenv] if col_tokenenv else pd.Series("", index=df.index)
+
+# sensor calculado (ficticio): sin provider ni token_env; se resuelve al
+# final, con las bases ya bajadas
+mask_calc = (prov == "") & (tenv == "")
+
+df["provider_id_res"] = prov.where(prov != "", DEFAULT_PROVIDER_ID)
+
+# token_env -> token: os.getenv solo una vez por valor distinto, mapeado
+# luego a toda la columna de golpe
+token_map = {env: (os.getenv(env, "").strip() if env else TOKEN_DEFAULT)
+             for env in tenv.unique()}
+df["token_res"] = tenv.map(token_map)
+
+mask_sin_token = ~mask_calc & (df["token_res"] == "")
+for sensor_id, token_env in zip(df.loc[mask_sin_token, "sensor_id"],
+                                tenv[mask_sin_token]):
+    print(f"❌ {sensor_id}: token vacío. Revisa token_env='{token_env}' o GitHub Secrets.")
+
+calculados = list(df.loc[mask_calc, ["sensor_id", "descripcion", "unidad"]]
+                  .itertuples(index=False, name=None))
+reales = list(df.loc[~mask_calc & ~mask_sin_token,
+                     ["sensor_id", "descripcion", "unidad",
+                      "provider_id_res", "token_res"]]
+              .itertuples(index=False, name=None))
+
+# Descarga asíncrona: todas las peticiones en vuelo a la vez (acotadas por
+# el semáforo y el token bucket); parseo+escritura en hilos solapados con
+# las descargas pendientes. El calculado va después, con sus bases ya bajadas.
+async def main():
+    connector = aiohttp.TCPConnector(limit_per_host=MAX_CONCURRENTES,
+                                     ttl_dns_cache=300)
+    sem = asyncio.Semaphore(MAX_CONCURRENTES)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     headers=HEADERS_BASE) as session:
+        await asyncio.gather(*(descargar_sensor(session, sem, a)
+                               for a in reales))
+
+        for sensor_id, descripcion, unidad in calculados:
+            await procesar_calculado(session, sensor_id, descripcion, unidad)
+
+
+asyncio.run(main())
+
+
+if registros_jsonl:
+    if OUTPUT_MODE == "jsonl":
+        escribir_bundle_jsonl()
+    elif OUTPUT_MODE == "bundle":
+        atomic_write_json(BUNDLE_JSON,
+                          {sj["sensor_id"]: sj for sj in registros_jsonl},
+                          compact=True)
+
+# ==================================================
+# ÍNDICE PARA DASHBOARD
+# ==================================================
+indice_sensores = dict(registros_indice)
+
+indice = {
+    "generado": datetime.now().isoformat(),
+    "sensores": indice_sensores
+}
+
+atomic_write_json(INDEX_JSON, indice, compact=True)
+
+print("\n✅ DESCARGA COMPLETADA")
+print(f"📁 Sensores válidos: {len(indice_sensores)}")